@@ -13,6 +13,8 @@ A compact program for analyzing fluorescence microscopy images:
 import os
 import sys
 import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 # Local imports
@@ -45,6 +47,9 @@ def parse_arguments():
     parser.add_argument('-v', '--visualize', action='store_true',
                         help='Visualize thresholds and masks')
     
+    parser.add_argument('--verbose', action='store_true',
+                        help='Log per-frame segmentation details')
+    
     args = parser.parse_args()
     
     # Set default output directory if not specified
@@ -57,6 +62,10 @@ def parse_arguments():
 def main():
     """Main function for fluorescence microscopy image analysis."""
     args = parse_arguments()
+    logging.basicConfig(level=logging.WARNING, format='%(message)s')
+    # Only this project's loggers go to DEBUG, not matplotlib and friends
+    if args.verbose:
+        logging.getLogger('utils').setLevel(logging.DEBUG)
     
     print(f"Processing file: {args.input_file}")
     print(f"Using {args.threshold} thresholding method")
@@ -77,25 +86,37 @@ def main():
         method=args.threshold,
         manual_threshold=args.threshold_value
     )
+    print(f"Segmented {cell_labels.max()} cells (threshold value: {threshold_value})")
     
     # Extract lifetime data for each cell
-    lifetime_data = extract_lifetime_data(lifetime_channel, segmented_cells, cell_labels)
+    cell_data, _, overall_stats = extract_lifetime_data(
+        lifetime_channel, segmented_cells, cell_labels
+    )
+    print(f"Extracted lifetime data for {overall_stats['cell_count']} cells")
+    print(f"Overall median lifetime: {overall_stats['overall_median_lifetime']:.4f} ns")
+    
+    # Save results to Excel in a background thread; file writing is I/O bound,
+    # so it can overlap with rendering the visualizations
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        excel_future = executor.submit(
+            export_to_excel, cell_data, overall_stats, output_dir=output_folder
+        )
+        
+        # Visualize results if requested
+        if args.visualize:
+            vis_path = visualize_results(
+                intensity_channel,
+                lifetime_channel,
+                segmented_cells,
+                cell_labels,
+                threshold_value,
+                output_dir=output_folder
+            )
+            print(f"Visualizations saved to: {vis_path}")
+        
+        excel_path = excel_future.result()
     
-    # Save results to Excel
-    excel_path = export_to_excel(lifetime_data, output_dir=output_folder)
     print(f"Results saved to: {excel_path}")
-    
-    # Visualize results if requested
-    if args.visualize:
-        vis_path = visualize_results(
-            intensity_channel,
-            lifetime_channel,
-            segmented_cells,
-            cell_labels,
-            threshold_value,
-            output_dir=output_folder
-        )
-        print(f"Visualizations saved to: {vis_path}")
 
 
 if __name__ == "__main__":
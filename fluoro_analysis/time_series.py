@@ -13,14 +13,20 @@ A script for analyzing fluorescence microscopy images with time dimension:
 import os
 import sys
 import argparse
+import logging
+import numba
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+from tqdm import tqdm
+from tqdm.contrib.concurrent import process_map
+
 # Local imports
 from utils.image_loader import load_time_series_tiff_stack
 from utils.cell_segmentation import segment_cells, track_cells_over_time
 from utils.lifetime_analysis import analyze_time_series_lifetime_data
 from visualization.visualizer import visualize_time_series
-from utils.excel_export import export_time_series_to_excel
+from utils.excel_export import export_time_series_to_excel, export_time_series_to_parquet
 
 
 def parse_arguments():
@@ -45,8 +51,29 @@ def parse_arguments():
     parser.add_argument('-v', '--visualize', action='store_true',
                         help='Visualize results with cell tracking')
     
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help='Number of worker processes for segmentation, lifetime '
+                             'extraction and rendering (default: number of CPUs, 1 = serial)')
+    
+    parser.add_argument('--otsu-cache-frames', type=int, default=1,
+                        help='Recompute the Otsu threshold only every N frames '
+                             '(or when mean intensity changes by more than 5%%) '
+                             'and reuse it in between (default: 1, every frame)')
+    
+    parser.add_argument('--xlsx', action='store_true',
+                        help='Also export results to Excel (Parquet is always written)')
+    
+    parser.add_argument('--per-cell-sheets', action='store_true',
+                        help='Also write one Excel sheet per tracked cell (with --xlsx)')
+    
+    parser.add_argument('--verbose', action='store_true',
+                        help='Log per-frame segmentation details')
+    
     args = parser.parse_args()
     
+    if args.otsu_cache_frames < 1:
+        parser.error('--otsu-cache-frames must be at least 1')
+    
     # Set default output directory if not specified
     if args.output is None:
         args.output = str(Path(args.input_file).parent)
@@ -54,9 +81,110 @@ def parse_arguments():
     return args
 
 
+def _segment_one(frame_args):
+    """
+    Segment a single time point (worker function for the process pool).
+    
+    Args:
+        frame_args (tuple): (intensity_image, method, manual_threshold,
+                             precomputed_threshold, numba_threads); numba_threads
+                             limits the threads of the parallel Numba kernels,
+                             or is None to keep Numba's default
+        
+    Returns:
+        tuple: (binary_mask, labeled_cells, threshold_value)
+    """
+    (intensity_image, method, manual_threshold, precomputed_threshold,
+     numba_threads) = frame_args
+    if numba_threads is not None:
+        numba.set_num_threads(numba_threads)
+    return segment_cells(
+        intensity_image,
+        method=method,
+        manual_threshold=manual_threshold,
+        precomputed_threshold=precomputed_threshold
+    )
+
+
+def _segment_frames(intensity_time_series, frame_indices, method, manual_threshold,
+                    precomputed_thresholds, jobs):
+    """
+    Segment a subset of time points, serially or with a process pool.
+    
+    Args:
+        intensity_time_series (ndarray): Intensity images indexed by time point
+        frame_indices (list): Time points to segment
+        method (str): Thresholding method
+        manual_threshold (float): Manual threshold value if method='manual'
+        precomputed_thresholds (list): Otsu threshold to reuse for each frame, or None
+        jobs (int): Number of worker processes (1 = serial)
+        
+    Returns:
+        dict: Maps each time point to its (binary_mask, labeled_cells, threshold_value)
+    """
+    # Pool workers already use every core between them, so each runs the
+    # Numba kernels single-threaded; the serial path keeps Numba's threads
+    serial = jobs is not None and jobs <= 1
+    numba_threads = None if serial else 1
+    frame_args = [
+        (intensity_time_series[t], method, manual_threshold, precomputed_threshold,
+         numba_threads)
+        for t, precomputed_threshold in zip(frame_indices, precomputed_thresholds)
+    ]
+    
+    if serial:
+        # Serial path, easier to debug
+        results = [
+            _segment_one(single_frame_args)
+            for single_frame_args in tqdm(frame_args, desc='Segmenting', unit='frame')
+        ]
+    else:
+        # Frames are independent, so segment them in parallel
+        results = process_map(
+            _segment_one, frame_args, max_workers=jobs, chunksize=4,
+            desc='Segmenting', unit='frame'
+        )
+    
+    return dict(zip(frame_indices, results))
+
+
+def _otsu_key_frames(intensity_time_series, cache_frames):
+    """
+    Decide which frame's Otsu threshold each time point reuses.
+    
+    A frame computes its own threshold every cache_frames frames, or when its
+    mean intensity differs by more than 5% from the last frame that did (estimated from
+    every 8th pixel in each direction).
+    
+    Args:
+        intensity_time_series (ndarray): Intensity images indexed by time point
+        cache_frames (int): Maximum number of frames sharing one threshold
+        
+    Returns:
+        list: Index of the frame whose threshold is used, for each time point
+    """
+    key_frames = []
+    key_t = 0
+    key_mean = None
+    
+    for t, intensity_image in enumerate(intensity_time_series):
+        # A strided subsample is enough to spot a 5% intensity change
+        mean_intensity = float(intensity_image[::8, ::8].mean())
+        if t % cache_frames == 0 or abs(mean_intensity - key_mean) > 0.05 * key_mean:
+            key_t = t
+            key_mean = mean_intensity
+        key_frames.append(key_t)
+    
+    return key_frames
+
+
 def main():
     """Main function for time series fluorescence microscopy image analysis."""
     args = parse_arguments()
+    logging.basicConfig(level=logging.WARNING, format='%(message)s')
+    # Only this project's loggers go to DEBUG, not matplotlib and friends
+    if args.verbose:
+        logging.getLogger('utils').setLevel(logging.DEBUG)
     
     print(f"Processing time series file: {args.input_file}")
     print(f"Using {args.threshold} thresholding method")
@@ -72,25 +200,39 @@ def main():
     intensity_time_series, lifetime_time_series = load_time_series_tiff_stack(args.input_file)
     
     # Process each time point
-    labeled_cells_time_series = []
-    binary_masks_time_series = []
-    threshold_values = []
+    time_points = len(intensity_time_series)
+    if args.threshold == 'otsu' and args.otsu_cache_frames > 1:
+        key_frames = _otsu_key_frames(intensity_time_series, args.otsu_cache_frames)
+    else:
+        key_frames = list(range(time_points))
     
     print("Segmenting cells in each time point...")
-    for t, intensity_image in enumerate(intensity_time_series):
-        print(f"Processing time point {t+1}/{len(intensity_time_series)}")
-        
-        # Segment cells in this time point
-        binary_mask, labeled_cells, threshold_value = segment_cells(
-            intensity_image,
-            method=args.threshold,
-            manual_threshold=args.threshold_value
-        )
-        
-        # Store results
-        binary_masks_time_series.append(binary_mask)
-        labeled_cells_time_series.append(labeled_cells)
-        threshold_values.append(threshold_value)
+    if args.jobs is None or args.jobs > 1:
+        print(f"Using {args.jobs} worker processes")
+    
+    # Segment the frames that compute their own threshold first
+    own_threshold = [t for t in range(time_points) if key_frames[t] == t]
+    results = _segment_frames(
+        intensity_time_series, own_threshold, args.threshold, args.threshold_value,
+        [None] * len(own_threshold), args.jobs
+    )
+    
+    # Then segment the remaining frames reusing their key frame's threshold
+    cached_threshold = [t for t in range(time_points) if key_frames[t] != t]
+    if cached_threshold:
+        print(f"Reusing cached Otsu thresholds for {len(cached_threshold)} frames")
+        results.update(_segment_frames(
+            intensity_time_series, cached_threshold, args.threshold, args.threshold_value,
+            [results[key_frames[t]][2] for t in cached_threshold], args.jobs
+        ))
+    
+    results = [results[t] for t in range(time_points)]
+    
+    binary_masks_time_series = [result[0] for result in results]
+    labeled_cells_time_series = [result[1] for result in results]
+    threshold_values = [result[2] for result in results]
+    cell_counts = [int(labeled_cells.max()) for labeled_cells in labeled_cells_time_series]
+    print(f"Segmented {min(cell_counts)}-{max(cell_counts)} cells per time point")
     
     # Track cells across time points
     print("Tracking cells across time points...")
@@ -101,25 +243,41 @@ def main():
     time_series_data = analyze_time_series_lifetime_data(
         lifetime_time_series, 
         labeled_cells_time_series,
-        tracking_data
+        tracking_data,
+        jobs=args.jobs
     )
     
-    # Save results to Excel
-    print("Exporting results to Excel...")
-    excel_path = export_time_series_to_excel(time_series_data, output_dir=args.output)
-    print(f"Results saved to: {excel_path}")
-    
-    # Visualize results if requested
-    if args.visualize:
-        print("Creating visualizations...")
-        vis_path = visualize_time_series(
-            intensity_time_series,
-            lifetime_time_series,
-            labeled_cells_time_series,
-            tracking_data,
-            output_dir=args.output
-        )
-        print(f"Visualizations saved to: {vis_path}")
+    # Save results to Parquet, and to Excel if requested, in background
+    # threads; file writing is I/O bound, so it can overlap with rendering
+    # the visualizations
+    print("Exporting results...")
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        export_futures = [executor.submit(
+            export_time_series_to_parquet, time_series_data, output_dir=args.output
+        )]
+        if args.xlsx:
+            export_futures.append(executor.submit(
+                export_time_series_to_excel,
+                time_series_data,
+                output_dir=args.output,
+                per_cell_sheets=args.per_cell_sheets
+            ))
+        
+        # Visualize results if requested
+        if args.visualize:
+            print("Creating visualizations...")
+            vis_path = visualize_time_series(
+                intensity_time_series,
+                lifetime_time_series,
+                labeled_cells_time_series,
+                tracking_data,
+                output_dir=args.output,
+                jobs=args.jobs
+            )
+            print(f"Visualizations saved to: {vis_path}")
+        
+        for future in export_futures:
+            print(f"Results saved to: {future.result()}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,47 @@
+"""
+Numba kernel for the median photon arrival time of TCSPC histograms.
+"""
+
+from numba import njit
+
+
+@njit(cache=True)
+def median_arrival_time(lifetime_histogram, time_values):
+    """
+    Find the time where the histogram's CDF crosses 0.5, interpolating linearly.
+
+    The CDF is accumulated on the fly instead of being stored as an array.
+
+    Args:
+        lifetime_histogram (ndarray): Histogram of photon arrival times
+        time_values (ndarray): Time values for each bin in nanoseconds
+
+    Returns:
+        float: Median arrival time in nanoseconds
+    """
+    n_bins = lifetime_histogram.shape[0]
+    total = 0.0
+    for count in lifetime_histogram:
+        total += count
+
+    if total == 0:
+        return 0.0
+
+    # Find the first bin where the CDF reaches 0.5
+    running = 0.0
+    cdf0 = 0.0
+    for median_bin in range(n_bins):
+        running += lifetime_histogram[median_bin]
+        cdf1 = running / total
+        if cdf1 >= 0.5:
+            if median_bin == 0:
+                return float(time_values[0])
+
+            t0 = float(time_values[median_bin - 1])
+            t1 = float(time_values[median_bin])
+            if cdf1 == cdf0:  # Avoid division by zero
+                return t0
+            return t0 + (0.5 - cdf0) * (t1 - t0) / (cdf1 - cdf0)
+        cdf0 = cdf1
+
+    return float(time_values[n_bins - 1])
@@ -0,0 +1,120 @@
+"""
+Numba kernels for building watershed markers from a distance map.
+"""
+
+import numpy as np
+from numba import njit, prange
+
+
+@njit(cache=True)
+def _is_window_max(distance, y, x, radius):
+    """Check whether distance[y, x] is the maximum of its square window."""
+    height, width = distance.shape
+    value = distance[y, x]
+
+    # Most pixels have a larger direct neighbor, so check those first
+    for yy in range(max(y - 1, 0), min(y + 2, height)):
+        for xx in range(max(x - 1, 0), min(x + 2, width)):
+            if distance[yy, xx] > value:
+                return False
+
+    for yy in range(max(y - radius, 0), min(y + radius + 1, height)):
+        for xx in range(max(x - radius, 0), min(x + radius + 1, width)):
+            if distance[yy, xx] > value:
+                return False
+
+    return True
+
+
+@njit(cache=True)
+def _find_root(parent, label):
+    """Find the root of a provisional label, compressing the path on the way."""
+    while parent[label] != label:
+        parent[label] = parent[parent[label]]
+        label = parent[label]
+    return label
+
+
+@njit(cache=True)
+def _label_peaks(peaks, n_peaks):
+    """Label 8-connected peak pixels with a two-pass union-find scan."""
+    height, width = peaks.shape
+    markers = np.zeros((height, width), np.int32)
+    parent = np.arange(n_peaks + 1)
+    next_label = 1
+
+    # First pass: provisional labels, merging touching groups
+    for y in range(height):
+        for x in range(width):
+            if not peaks[y, x]:
+                continue
+
+            label = 0
+            for dy, dx in ((0, -1), (-1, -1), (-1, 0), (-1, 1)):
+                yy = y + dy
+                xx = x + dx
+                if yy < 0 or xx < 0 or xx >= width:
+                    continue
+                neighbor = markers[yy, xx]
+                if neighbor == 0:
+                    continue
+                if label == 0:
+                    label = _find_root(parent, neighbor)
+                else:
+                    root_a = _find_root(parent, label)
+                    root_b = _find_root(parent, neighbor)
+                    if root_a != root_b:
+                        parent[max(root_a, root_b)] = min(root_a, root_b)
+                        label = min(root_a, root_b)
+
+            if label == 0:
+                label = next_label
+                next_label += 1
+            markers[y, x] = label
+
+    # Second pass: resolve to consecutive final labels in raster order
+    final_label = np.zeros(next_label, np.int32)
+    n_labels = 0
+    for y in range(height):
+        for x in range(width):
+            label = markers[y, x]
+            if label == 0:
+                continue
+            root = _find_root(parent, label)
+            if final_label[root] == 0:
+                n_labels += 1
+                final_label[root] = n_labels
+            markers[y, x] = final_label[root]
+
+    return markers
+
+
+@njit(parallel=True, cache=True)
+def fused_markers(distance, binary_mask, min_distance):
+    """
+    Find local maxima of a distance map and label them as watershed markers.
+
+    A pixel is a peak if it lies inside the mask, has a positive distance and
+    equals the maximum of the (2 * min_distance + 1) square window around it.
+    Touching peak pixels (8-connectivity), such as flat ridges, share a marker.
+
+    Args:
+        distance (ndarray): 2D distance map
+        binary_mask (ndarray): 2D boolean mask of segmented cells
+        min_distance (int): Half-width of the window a peak must dominate
+
+    Returns:
+        ndarray: int32 marker image, 0 for background and 1..N for peaks
+    """
+    height, width = distance.shape
+    peaks = np.zeros((height, width), np.bool_)
+    row_counts = np.zeros(height, np.int64)
+
+    for y in prange(height):
+        for x in range(width):
+            if binary_mask[y, x] and distance[y, x] > 0:
+                if _is_window_max(distance, y, x, min_distance):
+                    peaks[y, x] = True
+                    row_counts[y] += 1
+
+    return _label_peaks(peaks, row_counts.sum())
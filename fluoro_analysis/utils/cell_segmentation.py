@@ -2,13 +2,40 @@
 Module for cell segmentation in fluorescence microscopy images.
 """
 
+import logging
+
+import cv2
 import numpy as np
-from skimage import filters, measure, segmentation, morphology
-from skimage.feature import peak_local_max
-from scipy import ndimage as ndi
+from skimage import filters, segmentation
+
+from ._seg_numba import fused_markers
+
+logger = logging.getLogger(__name__)
+
+
+def _remove_small_regions(binary_mask, min_size):
+    """
+    Remove 4-connected regions smaller than min_size from a binary mask.
+    
+    Region areas come from a single connected components pass and are applied
+    with a label lookup table, rather than filtering each region separately.
+    
+    Args:
+        binary_mask (ndarray): Binary mask
+        min_size (int): Minimum region area in pixels to keep
+        
+    Returns:
+        ndarray: Binary mask with only the regions of at least min_size pixels
+    """
+    _, labels, stats, _ = cv2.connectedComponentsWithStats(
+        binary_mask.astype(np.uint8), connectivity=4
+    )
+    keep = stats[:, cv2.CC_STAT_AREA] >= min_size
+    keep[0] = False  # background
+    return keep[labels]
 
 
-def segment_cells(image, method='otsu', manual_threshold=None):
+def segment_cells(image, method='otsu', manual_threshold=None, precomputed_threshold=None):
     """
     Segment cells in a fluorescence microscopy image.
     
@@ -16,25 +43,48 @@ def segment_cells(image, method='otsu', manual_threshold=None):
         image (ndarray): 2D intensity image
         method (str): Thresholding method ('otsu', 'adaptive', 'manual')
         manual_threshold (float): Manual threshold value if method='manual'
+        precomputed_threshold (float): Otsu threshold (0-1 units) from a similar
+            frame to reuse instead of recomputing it, only used if method='otsu'
         
     Returns:
         tuple: (binary_mask, labeled_cells, threshold_value)
             - binary_mask: Binary mask of segmented cells
             - labeled_cells: Labeled image where each cell has unique integer ID
+              (uint16 unless there are too many cells)
             - threshold_value: The threshold value used for segmentation
     """
-    # Normalize image if needed (0-1 range)
-    if image.max() > 1.0:
-        image_normalized = image / np.max(image)
-    else:
-        image_normalized = image.copy()
+    # Scale that maps the image to the 0-1 range (images already in range are kept)
+    image_max = image.max()
+    scale = image_max if image_max > 1.0 else 1.0
     
     # Apply thresholding based on selected method
     if method == 'otsu':
-        threshold_value = filters.threshold_otsu(image_normalized)
-        binary_mask = image_normalized > threshold_value
+        # Quantize straight to 8 bits, without a floating point copy of the
+        # image; OpenCV's Otsu works on 8-bit images. The threshold is
+        # reported in 0-1 units
+        image_8bit = np.empty(image.shape, dtype=np.uint8)
+        np.multiply(image, 255.0 / scale, out=image_8bit, casting='unsafe')
+        if precomputed_threshold is None:
+            otsu_value, _ = cv2.threshold(
+                image_8bit, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU
+            )
+            # OpenCV returns 0 for a constant image, which would make the whole
+            # frame foreground; use the constant itself so the mask is empty
+            if image_8bit.min() == image_8bit.max():
+                otsu_value = float(image_8bit.max())
+        else:
+            otsu_value = precomputed_threshold * 255
+        threshold_value = otsu_value / 255
+        binary_mask = image_8bit > otsu_value
     
     elif method == 'adaptive':
+        # Normalize image if needed (0-1 range), in single precision and
+        # without copying images that are already in range
+        if image_max > 1.0:
+            image_normalized = np.multiply(image, 1.0 / image_max, dtype=np.float32)
+        else:
+            image_normalized = image
+        
         threshold_value = filters.threshold_local(
             image_normalized, block_size=35, offset=0.05
         )
@@ -46,99 +96,158 @@ def segment_cells(image, method='otsu', manual_threshold=None):
         if manual_threshold is None:
             raise ValueError("Manual threshold value must be provided")
         threshold_value = manual_threshold
-        binary_mask = image_normalized > threshold_value
+        # Compare in the original intensity units rather than normalizing
+        binary_mask = image > threshold_value * scale
     
     else:
         raise ValueError(f"Unknown thresholding method: {method}")
     
-    # Clean up the binary mask
-    binary_mask = morphology.remove_small_holes(binary_mask, area_threshold=50)
-    binary_mask = morphology.remove_small_objects(binary_mask, min_size=100)
+    # Clean up the binary mask: fill holes smaller than 50 pixels and
+    # remove objects smaller than 100 pixels
+    binary_mask = ~_remove_small_regions(~binary_mask, min_size=50)
+    binary_mask = _remove_small_regions(binary_mask, min_size=100)
     
     # Apply watershed segmentation to separate touching cells
-    distance = ndi.distance_transform_edt(binary_mask)
-    
-    # Find local maxima (cell centers)
-    local_max_coords = peak_local_max(
-        distance, min_distance=20, labels=binary_mask
+    distance = cv2.distanceTransform(
+        binary_mask.astype(np.uint8), cv2.DIST_L2, cv2.DIST_MASK_5
     )
     
-    # Create markers for watershed
-    markers = np.zeros_like(binary_mask, dtype=int)
-    markers[tuple(local_max_coords.T)] = np.arange(1, len(local_max_coords) + 1)
+    # Find local maxima (cell centers) that dominate a 41x41 neighborhood and
+    # label them as watershed markers in one pass, one marker per connected
+    # group of peak pixels so that flat ridges give a single marker
+    markers = fused_markers(distance, binary_mask, 20)
     
     # Apply watershed
     labeled_cells = segmentation.watershed(-distance, markers, mask=binary_mask)
     
-    print(f"Segmented {np.max(labeled_cells)} cells using {method} thresholding")
-    print(f"Threshold value: {threshold_value}")
+    # Store labels as uint16 whenever they fit, which halves the memory of the
+    # label images kept for every time point
+    n_cells = labeled_cells.max()
+    if n_cells < np.iinfo(np.uint16).max:
+        labeled_cells = labeled_cells.astype(np.uint16)
+    
+    logger.debug("Segmented %d cells using %s thresholding", n_cells, method)
+    logger.debug("Threshold value: %s", threshold_value)
     
     return binary_mask, labeled_cells, threshold_value
 
 
-def track_cells_over_time(labeled_cells_sequence):
+def _match_overlapping_labels(prev_labels, curr_labels, min_iou):
     """
-    Track cells across time points.
+    Match each cell in one frame to the cell it overlaps best in the next.
+    
+    Overlaps are counted only for the label pairs that actually occur, so
+    memory scales with the number of touching cell pairs rather than with
+    n_prev * n_curr. Each previous cell is matched to the current cell with
+    the highest intersection over union.
     
     Args:
-        labeled_cells_sequence (list): List of labeled cell images across time points
+        prev_labels (ndarray): Labeled image of the previous time point
+        curr_labels (ndarray): Labeled image of the current time point
+        min_iou (float): Matches with a lower intersection over union are rejected
         
     Returns:
-        dict: Dictionary mapping cell IDs across time points
+        tuple: (best_match, best_iou)
+            - best_match: array indexed by previous label with the matched
+              current label, or 0 if there is no match
+            - best_iou: array indexed by previous label with the match's IoU
+    """
+    prev = prev_labels.ravel().astype(np.int64)
+    curr = curr_labels.ravel().astype(np.int64)
+    n_prev = int(prev.max()) + 1
+    n_curr = int(curr.max()) + 1
+    
+    # Cell areas, with background counted at index 0
+    prev_area = np.bincount(prev, minlength=n_prev)
+    curr_area = np.bincount(curr, minlength=n_curr)
+    
+    # Overlap counts for the (previous, current) cell pairs that share pixels
+    foreground = (prev > 0) & (curr > 0)
+    pairs, overlaps = np.unique(
+        prev[foreground] * n_curr + curr[foreground], return_counts=True
+    )
+    pair_prev = pairs // n_curr
+    pair_curr = pairs % n_curr
+    iou = overlaps / (prev_area[pair_prev] + curr_area[pair_curr] - overlaps)
+    
+    # Best pair per previous cell: highest IoU, lowest current label on ties
+    order = np.lexsort((pair_curr, -iou, pair_prev))
+    first = order[np.diff(pair_prev[order], prepend=-1) != 0]
+    
+    best_match = np.zeros(n_prev, dtype=np.int64)
+    best_iou = np.zeros(n_prev)
+    best_match[pair_prev[first]] = pair_curr[first]
+    best_iou[pair_prev[first]] = iou[first]
+    best_match[best_iou < min_iou] = 0
+    
+    return best_match, best_iou
+
+
+def track_cells_over_time(labeled_cells_sequence, min_iou=0.2):
     """
-    # This is a placeholder for a more sophisticated tracking algorithm
-    # For now, we'll just use centroid proximity between consecutive frames
+    Track cells across time points by the overlap of their labels.
     
+    Args:
+        labeled_cells_sequence (list): List of labeled cell images across time points
+        min_iou (float): Minimum intersection over union between a cell and
+                         its match in the next time point
+        
+    Returns:
+        dict: Dictionary mapping cell IDs across time points, as
+              {orig_id: {t: (cell_id, iou)}} where iou is the overlap with
+              the track's cell at the previous time point
+    """
     tracking_data = {}
     
     if not labeled_cells_sequence:
         return tracking_data
     
     # Initialize with first frame cell IDs
-    first_frame = labeled_cells_sequence[0]
-    cell_props = measure.regionprops(first_frame)
+    first_labels = np.unique(labeled_cells_sequence[0])
     
-    for cell in cell_props:
-        cell_id = cell.label
-        tracking_data[cell_id] = {0: (cell_id, cell.centroid)}
+    for cell_id in first_labels[first_labels > 0]:
+        cell_id = int(cell_id)
+        tracking_data[cell_id] = {0: (cell_id, 1.0)}
+    
+    # Current label of each track matched in the previous frame
+    live_tracks = {cell_id: cell_id for cell_id in tracking_data}
     
     # Track cells across subsequent frames
     for t in range(1, len(labeled_cells_sequence)):
-        current_frame = labeled_cells_sequence[t]
-        current_props = measure.regionprops(current_frame)
-        
-        # Get centroids of previous frame cells
-        prev_centroids = {}
-        for cell_id in tracking_data:
-            # Check if the cell was tracked in the previous frame
-            if t-1 in tracking_data[cell_id]:
-                prev_centroids[cell_id] = tracking_data[cell_id][t-1][1]
+        if not live_tracks:
+            break
         
-        # Get centroids of current frame cells
-        current_centroids = {
-            cell.label: cell.centroid for cell in current_props
-        }
+        best_match, best_iou = _match_overlapping_labels(
+            labeled_cells_sequence[t - 1], labeled_cells_sequence[t], min_iou
+        )
         
-        # Match cells based on centroid proximity
-        for prev_id, prev_centroid in prev_centroids.items():
-            min_distance = float('inf')
-            best_match = None
-            
-            for curr_id, curr_centroid in current_centroids.items():
-                distance = np.sqrt(
-                    (prev_centroid[0] - curr_centroid[0])**2 +
-                    (prev_centroid[1] - curr_centroid[1])**2
-                )
-                
-                if distance < min_distance:
-                    min_distance = distance
-                    best_match = (curr_id, curr_centroid)
-            
-            # Only track if the distance is below a threshold
-            if min_distance < 50 and best_match:
-                if prev_id not in tracking_data:
-                    tracking_data[prev_id] = {}
-                tracking_data[prev_id][t] = best_match
+        # Tracks without a match in this frame are not continued
+        matched_tracks = {}
+        for track_id, prev_id in live_tracks.items():
+            curr_id = int(best_match[prev_id])
+            if curr_id > 0:
+                tracking_data[track_id][t] = (curr_id, float(best_iou[prev_id]))
+                matched_tracks[track_id] = curr_id
+        live_tracks = matched_tracks
     
     print(f"Tracked {len(tracking_data)} cells across {len(labeled_cells_sequence)} time points")
-    return tracking_data
\ No newline at end of file
+    return tracking_data
+
+
+def tracks_by_time_point(tracking_data, time_points):
+    """
+    Invert tracking data into the tracks present at each time point.
+    
+    Args:
+        tracking_data (dict): Cell tracking data from track_cells_over_time
+        time_points (int): Number of time points
+        
+    Returns:
+        list: For each time point, a list of (orig_id, cell_id) pairs for the
+              tracks present there, in tracking_data order
+    """
+    frame_tracks = [[] for _ in range(time_points)]
+    for orig_id, track_info in tracking_data.items():
+        for t, (cell_id, _) in track_info.items():
+            frame_tracks[t].append((orig_id, cell_id))
+    return frame_tracks
\ No newline at end of file
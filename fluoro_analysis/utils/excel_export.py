@@ -1,5 +1,5 @@
 """
-Module for exporting analysis results to Excel.
+Module for exporting analysis results to Excel and Parquet.
 """
 
 import os
@@ -8,12 +8,39 @@ import numpy as np
 from pathlib import Path
 
 
-def export_to_excel(cell_data, output_dir='.'):
+# Report headers for the per-cell columns, in sheet order
+CELL_DATA_HEADERS = {
+    'cell_id': 'Cell ID',
+    'area_pixels': 'Area (pixels)',
+    'centroid_x': 'Centroid X',
+    'centroid_y': 'Centroid Y',
+    'median_lifetime': 'Median Lifetime',
+    'mean_lifetime': 'Mean Lifetime',
+    'std_lifetime': 'Std Lifetime',
+    'min_lifetime': 'Min Lifetime',
+    'max_lifetime': 'Max Lifetime',
+}
+
+# Report headers for the time series columns, in sheet order
+TIME_SERIES_HEADERS = {
+    'cell_id': 'Cell ID',
+    'time_point': 'Time Point',
+    'median_lifetime': 'Median Lifetime',
+    'mean_lifetime': 'Mean Lifetime',
+    'std_lifetime': 'Std Lifetime',
+    'area_pixels': 'Area (pixels)',
+    'centroid_x': 'Centroid X',
+    'centroid_y': 'Centroid Y',
+}
+
+
+def export_to_excel(cell_data, overall_stats, output_dir='.'):
     """
     Export cell lifetime data to Excel.
     
     Args:
-        cell_data (dict): Dictionary containing lifetime data for each cell
+        cell_data (DataFrame): Per-cell lifetime statistics from extract_lifetime_data
+        overall_stats (dict): Image-wide statistics from extract_lifetime_data
         output_dir (str): Directory where the Excel file will be saved
         
     Returns:
@@ -23,36 +50,17 @@ def export_to_excel(cell_data, output_dir='.'):
     excel_dir = os.path.join(output_dir, 'excel_data')
     os.makedirs(excel_dir, exist_ok=True)
     
-    # Create Excel writer
+    # Create Excel writer (xlsxwriter is much faster than openpyxl for plain
+    # data; its constant_memory mode is not usable because pandas writes
+    # cells column by column, which that mode silently drops)
     output_path = os.path.join(excel_dir, 'lifetime_analysis_results.xlsx')
-    excel_writer = pd.ExcelWriter(output_path, engine='openpyxl')
-    
-    # Extract overall stats
-    overall_stats = cell_data.pop('overall', {})
-    
-    # Convert cell data to DataFrame
-    cell_rows = []
-    for cell_id, data in cell_data.items():
-        # Create a row for each cell, excluding the raw lifetime values
-        cell_row = {
-            'Cell ID': data['cell_id'],
-            'Area (pixels)': data['area_pixels'],
-            'Centroid X': data['centroid_x'],
-            'Centroid Y': data['centroid_y'],
-            'Median Lifetime': data['median_lifetime'],
-            'Mean Lifetime': data['mean_lifetime'],
-            'Std Lifetime': data['std_lifetime'],
-            'Min Lifetime': data['min_lifetime'],
-            'Max Lifetime': data['max_lifetime']
-        }
-        cell_rows.append(cell_row)
-    
-    # Create DataFrame from cell data
-    df_cells = pd.DataFrame(cell_rows)
+    excel_writer = pd.ExcelWriter(output_path, engine='xlsxwriter')
+    
+    # Rename the per-cell columns for the report
+    df_cells = cell_data[list(CELL_DATA_HEADERS)].rename(columns=CELL_DATA_HEADERS)
     
     # Sort by cell ID
-    if not df_cells.empty:
-        df_cells = df_cells.sort_values('Cell ID')
+    df_cells = df_cells.sort_values('Cell ID', kind='stable')
     
     # Create DataFrame for overall stats
     df_overall = pd.DataFrame([{
@@ -83,13 +91,31 @@ def export_to_excel(cell_data, output_dir='.'):
     return output_path
 
 
-def export_time_series_to_excel(time_series_data, output_dir='.'):
+def _time_series_table(time_series_data):
+    """
+    Build a table with one row per tracked cell and time point.
+    
+    Args:
+        time_series_data (DataFrame): Lifetime data over time for each tracked
+                                      cell from analyze_time_series_lifetime_data
+        
+    Returns:
+        DataFrame: Per-cell, per-time point lifetime data sorted by time point and cell ID
+    """
+    df_all_timepoints = time_series_data[list(TIME_SERIES_HEADERS)].rename(
+        columns=TIME_SERIES_HEADERS
+    )
+    return df_all_timepoints.sort_values(['Time Point', 'Cell ID'], kind='stable')
+
+
+def export_time_series_to_excel(time_series_data, output_dir='.', per_cell_sheets=False):
     """
     Export time series lifetime data to Excel.
     
     Args:
-        time_series_data (dict): Dictionary containing lifetime data over time for each tracked cell
+        time_series_data (DataFrame): Lifetime data over time for each tracked cell
         output_dir (str): Directory where the Excel file will be saved
+        per_cell_sheets (bool): Also write a separate sheet for every cell
         
     Returns:
         str: Path to the saved Excel file
@@ -98,80 +124,77 @@ def export_time_series_to_excel(time_series_data, output_dir='.'):
     excel_dir = os.path.join(output_dir, 'excel_data')
     os.makedirs(excel_dir, exist_ok=True)
     
-    # Create Excel writer
+    # Create Excel writer (xlsxwriter is much faster than openpyxl for plain
+    # data; its constant_memory mode is not usable because pandas writes
+    # cells column by column, which that mode silently drops)
     output_path = os.path.join(excel_dir, 'time_series_lifetime_analysis.xlsx')
-    excel_writer = pd.ExcelWriter(output_path, engine='openpyxl')
-    
-    # Create summary sheet with one row per cell
-    summary_rows = []
-    for cell_id, data in time_series_data.items():
-        # Calculate statistics across time points
-        median_lifetimes = np.array(data['median_lifetime'])
-        mean_lifetimes = np.array(data['mean_lifetime'])
-        
-        summary_row = {
-            'Cell ID': cell_id,
-            'Number of Time Points': len(data['time_points']),
-            'Mean of Median Lifetimes': np.mean(median_lifetimes),
-            'Std of Median Lifetimes': np.std(median_lifetimes),
-            'Mean of Mean Lifetimes': np.mean(mean_lifetimes),
-            'Std of Mean Lifetimes': np.std(mean_lifetimes)
-        }
-        summary_rows.append(summary_row)
-    
-    # Create summary DataFrame
-    df_summary = pd.DataFrame(summary_rows)
-    
-    if not df_summary.empty:
-        df_summary = df_summary.sort_values('Cell ID')
-        
-    # Write summary to Excel
-    df_summary.to_excel(excel_writer, sheet_name='Summary', index=False)
+    excel_writer = pd.ExcelWriter(output_path, engine='xlsxwriter')
     
-    # Create all-in-one timepoint data sheet
-    all_timepoint_rows = []
-    for cell_id, data in time_series_data.items():
-        for i, time_point in enumerate(data['time_points']):
-            row = {
-                'Cell ID': cell_id,
-                'Time Point': time_point,
-                'Median Lifetime': data['median_lifetime'][i],
-                'Mean Lifetime': data['mean_lifetime'][i],
-                'Std Lifetime': data['std_lifetime'][i],
-                'Area (pixels)': data['area_pixels'][i],
-                'Centroid X': data['centroid_x'][i] if 'centroid_x' in data else None,
-                'Centroid Y': data['centroid_y'][i] if 'centroid_y' in data else None
-            }
-            all_timepoint_rows.append(row)
-    
-    # Create all-timepoints DataFrame
-    df_all_timepoints = pd.DataFrame(all_timepoint_rows)
+    # Create all-in-one timepoint data
+    df_all_timepoints = _time_series_table(time_series_data)
     
+    # Create summary with one row per cell, calculating statistics across time points
     if not df_all_timepoints.empty:
-        df_all_timepoints = df_all_timepoints.sort_values(['Time Point', 'Cell ID'])
-    
-    # Write all timepoints data to Excel
+        grouped = df_all_timepoints.groupby('Cell ID')
+        df_summary = pd.DataFrame({
+            'Number of Time Points': grouped['Time Point'].count(),
+            'Mean of Median Lifetimes': grouped['Median Lifetime'].mean(),
+            'Std of Median Lifetimes': grouped['Median Lifetime'].std(ddof=0),
+            'Mean of Mean Lifetimes': grouped['Mean Lifetime'].mean(),
+            'Std of Mean Lifetimes': grouped['Mean Lifetime'].std(ddof=0)
+        }).reset_index()
+    else:
+        df_summary = pd.DataFrame()
+    
+    # Write summary and all timepoints data to Excel
+    df_summary.to_excel(excel_writer, sheet_name='Summary', index=False)
     df_all_timepoints.to_excel(excel_writer, sheet_name='All Timepoints', index=False)
     
-    # Also keep the per-cell time series sheets for reference
-    for cell_id, data in time_series_data.items():
-        # Create DataFrame for this cell's time series
-        df_cell = pd.DataFrame({
-            'Time Point': data['time_points'],
-            'Median Lifetime': data['median_lifetime'],
-            'Mean Lifetime': data['mean_lifetime'],
-            'Std Lifetime': data['std_lifetime'],
-            'Area (pixels)': data['area_pixels']
-        })
-        
-        # Write to Excel with cell ID as sheet name (limited to 31 chars)
-        sheet_name = f'Cell_{cell_id}'
-        if len(sheet_name) > 31:
-            sheet_name = sheet_name[:31]
-        df_cell.to_excel(excel_writer, sheet_name=sheet_name, index=False)
+    # Optionally write per-cell sheets; they duplicate 'All Timepoints'
+    # and cost one sheet per cell, so they are off by default
+    if per_cell_sheets:
+        per_cell_columns = [
+            'Time Point', 'Median Lifetime', 'Mean Lifetime', 'Std Lifetime', 'Area (pixels)'
+        ]
+        for cell_id, df_cell in df_all_timepoints.groupby('Cell ID'):
+            # Select this cell's time series
+            df_cell = df_cell[per_cell_columns].sort_values('Time Point', kind='stable')
+            
+            # Write to Excel with cell ID as sheet name (limited to 31 chars)
+            sheet_name = f'Cell_{cell_id}'
+            if len(sheet_name) > 31:
+                sheet_name = sheet_name[:31]
+            df_cell.to_excel(excel_writer, sheet_name=sheet_name, index=False)
     
     # Close Excel writer
     excel_writer.close()
     
+    print(f"Exported time series data to: {output_path}")
+    return output_path
+
+
+def export_time_series_to_parquet(time_series_data, output_dir='.'):
+    """
+    Export time series lifetime data to a Parquet file.
+    
+    Writes the same per-cell, per-time point table as the 'All Timepoints'
+    Excel sheet, but as a compressed columnar file that is much faster to
+    write and to load for further analysis.
+    
+    Args:
+        time_series_data (DataFrame): Lifetime data over time for each tracked cell
+        output_dir (str): Directory where the Parquet file will be saved
+        
+    Returns:
+        str: Path to the saved Parquet file
+    """
+    # Create a dedicated subfolder for Parquet data
+    parquet_dir = os.path.join(output_dir, 'parquet_data')
+    os.makedirs(parquet_dir, exist_ok=True)
+    
+    output_path = os.path.join(parquet_dir, 'time_series_lifetime_analysis.parquet')
+    df_all_timepoints = _time_series_table(time_series_data)
+    df_all_timepoints.to_parquet(output_path, compression='snappy', index=False)
+    
     print(f"Exported time series data to: {output_path}")
     return output_path
\ No newline at end of file
@@ -3,7 +3,7 @@ Module for loading and handling TIFF stack images.
 """
 
 import numpy as np
-from tifffile import imread
+from tifffile import imread, memmap
 
 
 def load_tiff_stack(file_path):
@@ -41,20 +41,29 @@ def load_tiff_stack(file_path):
         raise
 
 
-def load_time_series_tiff_stack(file_path):
+def load_time_series_tiff_stack(file_path, copy=False):
     """
     Load a TIFF stack containing a time series of intensity and lifetime channels.
     
+    The stack is memory-mapped rather than read into RAM, so frames are only
+    paged in from disk when they are accessed.
+    
     Args:
         file_path (str): Path to the TIFF stack file
+        copy (bool): Copy each channel into a contiguous in-memory array instead
+                     of returning views into the memory-mapped stack
         
     Returns:
         tuple: (intensity_time_series, lifetime_time_series) as numpy arrays
-               Each is a list of 2D arrays, one per time point
+               Each is a 3D array indexed by time point, (T, Y, X)
     """
     try:
-        # Load the entire stack
-        stack = imread(file_path)
+        try:
+            # Map the file directly if the image data is stored uncompressed
+            stack = memmap(file_path, mode='r')
+        except ValueError:
+            # Otherwise decode into a temporary memory-mapped file
+            stack = imread(file_path, out='memmap')
         
         # For time series, we expect shape (T, C, Y, X)
         # where T is time points, C is channels (intensity, lifetime)
@@ -67,13 +76,13 @@ def load_time_series_tiff_stack(file_path):
         
         time_points = stack.shape[0]
         
-        # Extract channels for each time point
-        intensity_time_series = []
-        lifetime_time_series = []
+        # Slice out each channel across all time points
+        intensity_time_series = stack[:, 0]
+        lifetime_time_series = stack[:, 1]
         
-        for t in range(time_points):
-            intensity_time_series.append(stack[t, 0])
-            lifetime_time_series.append(stack[t, 1])
+        if copy:
+            intensity_time_series = np.ascontiguousarray(intensity_time_series)
+            lifetime_time_series = np.ascontiguousarray(lifetime_time_series)
         
         print(f"Loaded time series TIFF stack with {time_points} time points")
         print(f"Each image has shape: {intensity_time_series[0].shape}")
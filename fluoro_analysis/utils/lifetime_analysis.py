@@ -2,32 +2,63 @@
 Module for extracting and analyzing lifetime data from fluorescence microscopy images.
 """
 
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
 import pandas as pd
 from skimage import measure
 
+from ._lifetime_numba import median_arrival_time
+from .cell_segmentation import tracks_by_time_point
+
+logger = logging.getLogger(__name__)
+
+
+# Per-cell statistics returned by extract_lifetime_data, one column each
+CELL_DATA_COLUMNS = (
+    'cell_id',
+    'area_pixels',
+    'centroid_y',
+    'centroid_x',
+    'median_lifetime',
+    'mean_lifetime',
+    'std_lifetime',
+    'min_lifetime',
+    'max_lifetime',
+)
+
+# Raw 16-bit lifetime values (0-65535) cover 0-10 ns
+RAW_TO_NS_SCALE = np.float32(10.0 / 65535.0)
+
 
-def convert_raw_to_nanoseconds(lifetime_image):
+def convert_raw_to_nanoseconds(lifetime_image, out=None):
     """
     Convert raw lifetime values from Leica LASX FLIM format to nanoseconds.
     
     The Leica LASX software exports lifetimes as 16-bit values (0-65535) 
-    scaled to represent a 0-10 ns range. We divide by 65535/10 = 6553.5 
-    to get the actual lifetime values in nanoseconds.
+    scaled to represent a 0-10 ns range. We multiply by 10/65535 to get the
+    actual lifetime values in nanoseconds, in single precision.
     
     Args:
         lifetime_image (ndarray): Raw lifetime image from TIFF stack
+        out (ndarray): Optional preallocated float32 array for the result
         
     Returns:
-        ndarray: Lifetime image in nanoseconds (0-10 ns range)
+        ndarray: float32 lifetime image in nanoseconds (0-10 ns range)
     """
-    # Convert to float to avoid integer division issues
-    lifetime_ns = np.array(lifetime_image, dtype=float)
+    # Convert from raw 16-bit values (0-65535) to nanoseconds (0-10) with a
+    # single float32 multiply, which halves memory traffic versus float64
+    lifetime_ns = np.multiply(
+        lifetime_image, RAW_TO_NS_SCALE, out=out, dtype=np.float32, casting='unsafe'
+    )
     
-    # Convert from raw 16-bit values (0-65535) to nanoseconds (0-10)
-    lifetime_ns /= 6553.5
-    
-    print(f"Converted lifetime values to nanoseconds: min={np.min(lifetime_ns):.3f}ns, max={np.max(lifetime_ns):.3f}ns")
+    # The range takes two extra full-image passes, so only compute it when logged
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            "Converted lifetime values to nanoseconds: min=%.3fns, max=%.3fns",
+            lifetime_ns.min(), lifetime_ns.max()
+        )
     return lifetime_ns
 
 
@@ -36,7 +67,7 @@ def calculate_median_arrival_time(lifetime_histogram, time_values):
     Calculate the median photon arrival time for a TCSPC histogram.
     
     This implements a more accurate approach for median calculation:
-    1. Computes the cumulative distribution function (CDF)
+    1. Accumulates the cumulative distribution function (CDF) in a compiled loop
     2. Finds the exact time point where CDF = 0.5 (median)
     3. Uses linear interpolation for sub-bin precision
     
@@ -47,33 +78,10 @@ def calculate_median_arrival_time(lifetime_histogram, time_values):
     Returns:
         float: Median arrival time in nanoseconds
     """
-    if np.sum(lifetime_histogram) == 0:
-        return 0.0
-    
-    # Calculate cumulative distribution
-    cdf = np.cumsum(lifetime_histogram) / np.sum(lifetime_histogram)
-    
-    # Find bins where cdf crosses 0.5
-    median_bin = np.searchsorted(cdf, 0.5)
-    
-    # Safety check
-    if median_bin == 0:
-        return time_values[0]
-    elif median_bin >= len(cdf):
-        return time_values[-1]
-    
-    # Linear interpolation for more precise median
-    # Find adjacent time points and CDF values
-    t0, t1 = time_values[median_bin-1], time_values[median_bin]
-    cdf0, cdf1 = cdf[median_bin-1], cdf[median_bin]
-    
-    # Interpolate to find exact time where CDF = 0.5
-    if cdf1 == cdf0:  # Avoid division by zero
-        median_time = t0
-    else:
-        median_time = t0 + (0.5 - cdf0) * (t1 - t0) / (cdf1 - cdf0)
-    
-    return median_time
+    return median_arrival_time(
+        np.asarray(lifetime_histogram, dtype=np.float64),
+        np.asarray(time_values, dtype=np.float64)
+    )
 
 
 def extract_lifetime_data(lifetime_image, binary_mask, cell_labels, convert_to_ns=True):
@@ -87,61 +95,84 @@ def extract_lifetime_data(lifetime_image, binary_mask, cell_labels, convert_to_n
         convert_to_ns (bool): Whether to convert raw values to nanoseconds
         
     Returns:
-        dict: Dictionary containing lifetime statistics for each cell
+        tuple: (cell_data, lifetimes_per_cell, overall_stats)
+            - cell_data: DataFrame with one row per cell (in label order) and
+              the CELL_DATA_COLUMNS columns
+            - lifetimes_per_cell: dict mapping cell ID to its lifetime values
+            - overall_stats: dict of image-wide statistics
     """
     # Convert raw lifetime values to nanoseconds if needed
     if convert_to_ns:
         lifetime_image = convert_raw_to_nanoseconds(lifetime_image)
     
-    # Get properties of each labeled region
-    regions = measure.regionprops(cell_labels, intensity_image=lifetime_image)
+    # Get label and centroid of every labeled region as arrays
+    props = measure.regionprops_table(
+        cell_labels, properties=('label', 'centroid'), cache=True
+    )
     
-    # Initialize data structure for results
-    cell_data = {}
-    all_lifetimes = []
+    # Drop the background (label 0), usually most of the image, up front so
+    # that no later pass touches it
+    foreground_pixels = np.flatnonzero(cell_labels)
+    labels = cell_labels.ravel()[foreground_pixels]
+    lifetimes = lifetime_image.ravel()[foreground_pixels]
     
-    # Extract lifetime data for each cell
-    for region in regions:
-        cell_id = region.label
-        
-        # Get all lifetime values within this cell
-        cell_mask = (cell_labels == cell_id)
-        cell_lifetimes = lifetime_image[cell_mask]
-        
-        # Skip cells with no valid lifetime data
-        if len(cell_lifetimes) == 0:
-            continue
-        
-        # Calculate statistics
-        median_lifetime = np.median(cell_lifetimes)
-        mean_lifetime = np.mean(cell_lifetimes)
-        std_lifetime = np.std(cell_lifetimes)
-        min_lifetime = np.min(cell_lifetimes)
-        max_lifetime = np.max(cell_lifetimes)
-        
-        # Store data for this cell
-        cell_data[cell_id] = {
-            'cell_id': cell_id,
-            'area_pixels': region.area,
-            'centroid_y': region.centroid[0],
-            'centroid_x': region.centroid[1],
-            'median_lifetime': median_lifetime,
-            'mean_lifetime': mean_lifetime,
-            'std_lifetime': std_lifetime,
-            'min_lifetime': min_lifetime,
-            'max_lifetime': max_lifetime,
-            'all_lifetimes': cell_lifetimes
-        }
-        
-        # Collect all lifetime values for overall statistics
-        all_lifetimes.extend(cell_lifetimes)
+    # Sort pixels by label, then by lifetime, so that each cell's lifetime
+    # values form one contiguous, sorted slice
+    order = np.lexsort((lifetimes, labels))
+    sorted_labels = labels[order]
+    sorted_lifetimes = lifetimes[order]
+    
+    starts = np.searchsorted(sorted_labels, props['label'], side='left')
+    ends = np.searchsorted(sorted_labels, props['label'], side='right')
+    
+    # Skip cells with no valid lifetime data
+    has_data = ends > starts
+    starts = starts[has_data]
+    ends = ends[has_data]
     
-    # Calculate overall statistics
-    if all_lifetimes:
+    cell_ids = props['label'][has_data]
+    
+    # Area, mean and std of every label in linear bincount passes over the
+    # cell pixels; the std is taken around the mean to stay accurate for cells with
+    # nearly constant lifetimes
+    counts = np.bincount(labels)
+    means = np.bincount(labels, weights=lifetimes) / np.maximum(counts, 1)
+    deviations = lifetimes - means.astype(np.result_type(lifetimes, np.float32))[labels]
+    variances = np.bincount(labels, weights=deviations * deviations) / np.maximum(counts, 1)
+    
+    # Each cell's slice is sorted, so its order statistics are plain lookups;
+    # the median averages the two middle values (the same one for odd sizes)
+    lower_middle = sorted_lifetimes[(starts + ends - 1) // 2].astype(np.float64)
+    upper_middle = sorted_lifetimes[(starts + ends) // 2].astype(np.float64)
+    median_lifetimes = (lower_middle + upper_middle) / 2
+    min_lifetimes = sorted_lifetimes[starts]
+    max_lifetimes = sorted_lifetimes[ends - 1]
+    
+    # Store per-cell data as one column per statistic
+    cell_data = pd.DataFrame({
+        'cell_id': cell_ids,
+        'area_pixels': counts[cell_ids],
+        'centroid_y': props['centroid-0'][has_data],
+        'centroid_x': props['centroid-1'][has_data],
+        'median_lifetime': median_lifetimes,
+        'mean_lifetime': means[cell_ids],
+        'std_lifetime': np.sqrt(variances[cell_ids]),
+        'min_lifetime': min_lifetimes,
+        'max_lifetime': max_lifetimes,
+    }, columns=CELL_DATA_COLUMNS)
+    
+    # Raw lifetime values per cell, as views into the sorted lifetimes
+    lifetimes_per_cell = {
+        int(cell_id): sorted_lifetimes[start:end]
+        for cell_id, start, end in zip(cell_ids, starts, ends)
+    }
+    
+    # Calculate overall statistics over all cell pixels
+    if sorted_lifetimes.size:
         overall_stats = {
-            'overall_median_lifetime': np.median(all_lifetimes),
-            'overall_mean_lifetime': np.mean(all_lifetimes),
-            'overall_std_lifetime': np.std(all_lifetimes),
+            'overall_median_lifetime': np.median(sorted_lifetimes),
+            'overall_mean_lifetime': np.mean(sorted_lifetimes, dtype=np.float64),
+            'overall_std_lifetime': np.std(sorted_lifetimes, dtype=np.float64),
             'cell_count': len(cell_data),
             'total_area_pixels': np.sum(binary_mask),
         }
@@ -154,16 +185,33 @@ def extract_lifetime_data(lifetime_image, binary_mask, cell_labels, convert_to_n
             'total_area_pixels': 0,
         }
     
-    # Add overall stats to the results
-    cell_data['overall'] = overall_stats
+    logger.debug("Extracted lifetime data for %d cells", overall_stats['cell_count'])
+    logger.debug("Overall median lifetime: %.4f ns", overall_stats['overall_median_lifetime'])
     
-    print(f"Extracted lifetime data for {len(cell_data) - 1} cells")
-    print(f"Overall median lifetime: {overall_stats['overall_median_lifetime']:.4f} ns")
+    return cell_data, lifetimes_per_cell, overall_stats
+
+
+def _extract_one(frame):
+    """
+    Extract per-cell lifetime data for one time point (process pool worker).
     
+    Args:
+        frame (tuple): (lifetime_image, labeled_cells, convert_to_ns)
+        
+    Returns:
+        DataFrame: Per-cell statistics from extract_lifetime_data; the
+                   per-pixel lifetimes and overall statistics are not sent
+                   back to the main process
+    """
+    lifetime_image, labeled_cells, convert_to_ns = frame
+    cell_data, _, _ = extract_lifetime_data(
+        lifetime_image, labeled_cells > 0, labeled_cells, convert_to_ns=convert_to_ns
+    )
     return cell_data
 
 
-def analyze_time_series_lifetime_data(lifetime_time_series, labeled_cells_time_series, tracking_data):
+def analyze_time_series_lifetime_data(lifetime_time_series, labeled_cells_time_series,
+                                      tracking_data, jobs=None, convert_to_ns=True):
     """
     Analyze lifetime data over time for tracked cells.
     
@@ -171,50 +219,50 @@ def analyze_time_series_lifetime_data(lifetime_time_series, labeled_cells_time_s
         lifetime_time_series (list): List of lifetime images for each time point
         labeled_cells_time_series (list): List of labeled cell images for each time point
         tracking_data (dict): Cell tracking data from track_cells_over_time
+        jobs (int): Number of worker processes (1 = serial, default: number of CPUs)
+        convert_to_ns (bool): Whether to convert raw values to nanoseconds; pass
+                              False if the stack is already in nanoseconds
         
     Returns:
-        dict: Dictionary containing lifetime data over time for each tracked cell
+        DataFrame: One row per tracked cell and time point, with the tracked
+                   (original) cell ID in 'cell_id', a 'time_point' column and
+                   the remaining CELL_DATA_COLUMNS
     """
-    time_series_data = {}
     time_points = len(lifetime_time_series)
     
-    # For each time point, extract lifetime data
-    for t in range(time_points):
-        lifetime_image = lifetime_time_series[t]
-        labeled_cells = labeled_cells_time_series[t]
-        
-        # Extract lifetime data for this time point
-        time_point_data = extract_lifetime_data(
-            lifetime_image, labeled_cells > 0, labeled_cells
+    # Each frame is converted to nanoseconds inside its worker, so only one
+    # converted frame per worker is held in memory (the stack may be memory-mapped)
+    frames = (
+        (lifetime_image, labeled_cells, convert_to_ns)
+        for lifetime_image, labeled_cells in zip(lifetime_time_series, labeled_cells_time_series)
+    )
+    
+    # Extract lifetime data for every time point; frames are independent, so
+    # they are processed in parallel unless running serially
+    if jobs is not None and jobs <= 1:
+        per_frame = [_extract_one(frame) for frame in frames]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            per_frame = list(executor.map(_extract_one, frames, chunksize=4))
+    
+    # Join each time point's cells with the tracks present there
+    frame_tracks = tracks_by_time_point(tracking_data, time_points)
+    tracked_frames = []
+    for t, cell_data in enumerate(per_frame):
+        tracks = pd.DataFrame(
+            frame_tracks[t], columns=['track_id', 'cell_id'], dtype=np.int64
         )
-        
-        # Remove overall stats for time series
-        overall_stats = time_point_data.pop('overall', {})
-        
-        # Organize data by tracked cell ID
-        for orig_cell_id, track_info in tracking_data.items():
-            if t in track_info:
-                current_cell_id = track_info[t][0]
-                
-                if current_cell_id in time_point_data:
-                    cell_data = time_point_data[current_cell_id]
-                    
-                    # Initialize tracking entry if needed
-                    if orig_cell_id not in time_series_data:
-                        time_series_data[orig_cell_id] = {
-                            'median_lifetime': [],
-                            'mean_lifetime': [],
-                            'std_lifetime': [],
-                            'time_points': [],
-                            'area_pixels': []
-                        }
-                    
-                    # Add data for this time point
-                    time_series_data[orig_cell_id]['median_lifetime'].append(cell_data['median_lifetime'])
-                    time_series_data[orig_cell_id]['mean_lifetime'].append(cell_data['mean_lifetime'])
-                    time_series_data[orig_cell_id]['std_lifetime'].append(cell_data['std_lifetime'])
-                    time_series_data[orig_cell_id]['area_pixels'].append(cell_data['area_pixels'])
-                    time_series_data[orig_cell_id]['time_points'].append(t)
-    
-    print(f"Analyzed lifetime data for {len(time_series_data)} tracked cells across {time_points} time points")
-    return time_series_data
\ No newline at end of file
+        tracked = tracks.merge(
+            cell_data.astype({'cell_id': np.int64}), on='cell_id', how='inner'
+        )
+        tracked['cell_id'] = tracked.pop('track_id')
+        tracked.insert(1, 'time_point', t)
+        tracked_frames.append(tracked)
+    
+    if tracked_frames:
+        time_series_data = pd.concat(tracked_frames, ignore_index=True)
+    else:
+        time_series_data = pd.DataFrame(columns=['cell_id', 'time_point', *CELL_DATA_COLUMNS[1:]])
+    
+    print(f"Analyzed lifetime data for {time_series_data['cell_id'].nunique()} tracked cells across {time_points} time points")
+    return time_series_data
@@ -2,13 +2,71 @@
 Module for visualizing fluorescence microscopy analysis results.
 """
 
+import multiprocessing
 import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
 import numpy as np
+import matplotlib
+
+# Figures are only saved to files, so use the non-interactive Agg backend
+matplotlib.use('Agg')
+
 import matplotlib.pyplot as plt
 from matplotlib.colors import ListedColormap
-from skimage import color, segmentation
+from skimage import color
 from pathlib import Path
 
+from utils.cell_segmentation import tracks_by_time_point
+
+
+def _label_boundaries(cell_labels):
+    """
+    Find cell boundaries as pixels with a 4-neighbor of a different label.
+    
+    Equivalent to skimage's find_boundaries in its default 'thick' mode, using
+    shifted comparisons of the label image instead of grayscale morphology.
+    
+    Args:
+        cell_labels (ndarray): Labeled image where each cell has unique integer ID
+        
+    Returns:
+        ndarray: Boolean boundary mask
+    """
+    boundaries = np.zeros(cell_labels.shape, dtype=bool)
+    
+    # Both pixels of every differing vertical and horizontal pair are boundaries
+    differ = cell_labels[:-1, :] != cell_labels[1:, :]
+    boundaries[:-1, :] |= differ
+    boundaries[1:, :] |= differ
+    
+    differ = cell_labels[:, :-1] != cell_labels[:, 1:]
+    boundaries[:, :-1] |= differ
+    boundaries[:, 1:] |= differ
+    
+    return boundaries
+
+
+@lru_cache(maxsize=8)
+def _cell_colors(n_cells):
+    """
+    Generate reproducible random colors for cell labels 0..n_cells.
+    
+    Uses its own seeded generator, so the global NumPy RNG is left untouched.
+    
+    Args:
+        n_cells (int): Number of cells
+        
+    Returns:
+        ndarray: Read-only (n_cells + 1, 3) array of RGB colors, black for label 0
+    """
+    rng = np.random.default_rng(42)
+    colors = rng.random((n_cells + 1, 3))
+    colors[0] = [0, 0, 0]  # background is black
+    colors.flags.writeable = False
+    return colors
+
 
 def visualize_results(intensity_image, lifetime_image, binary_mask, cell_labels, 
                       threshold_value, output_dir='.'):
@@ -44,16 +102,13 @@ def visualize_results(intensity_image, lifetime_image, binary_mask, cell_labels,
     # Plot labeled cells (use random colormap for better visibility)
     # Create colormap for cell labels (random colors)
     n_labels = np.max(cell_labels)
-    np.random.seed(42)  # for reproducibility
-    colors = np.random.rand(n_labels + 1, 3)
-    colors[0] = [0, 0, 0]  # background is black
-    cell_cmap = ListedColormap(colors)
+    cell_cmap = ListedColormap(_cell_colors(int(n_labels)))
     
     im2 = axes[1, 0].imshow(cell_labels, cmap=cell_cmap)
     axes[1, 0].set_title(f'Segmented Cells (n={n_labels})')
     
     # Plot lifetime image with cell boundaries
-    boundaries = segmentation.find_boundaries(cell_labels)
+    boundaries = _label_boundaries(cell_labels)
     lifetime_with_boundaries = np.copy(lifetime_image)
     
     # If grayscale, convert to RGB for adding colored boundaries
@@ -61,7 +116,7 @@ def visualize_results(intensity_image, lifetime_image, binary_mask, cell_labels,
         lifetime_with_boundaries = color.gray2rgb(lifetime_with_boundaries / np.max(lifetime_with_boundaries))
     
     # Overlay cell boundaries in red
-    lifetime_with_boundaries[boundaries] = [1, 0, 0]  # Red boundaries
+    lifetime_with_boundaries[boundaries] = (1, 0, 0)  # Red boundaries
     
     im3 = axes[1, 1].imshow(lifetime_with_boundaries)
     axes[1, 1].set_title('Lifetime with Cell Boundaries')
@@ -81,18 +136,22 @@ def visualize_results(intensity_image, lifetime_image, binary_mask, cell_labels,
     fig2, ax = plt.subplots(figsize=(12, 10))
     ax.imshow(intensity_image, cmap='gray', alpha=0.7)
     
-    # Get properties of each labeled region to add cell ID text
+    # Get label and centroid of each labeled region to add cell ID text
     from skimage import measure
-    regions = measure.regionprops(cell_labels)
+    props = measure.regionprops_table(cell_labels, properties=('label', 'centroid'))
+    
+    # Draw the dark backdrops behind all IDs as a single scatter collection,
+    # rather than a bbox patch per text
+    ax.scatter(props['centroid-1'], props['centroid-0'], s=120,
+               c='black', alpha=0.5, linewidths=0)
     
     # Add cell ID text to each cell
-    for region in regions:
-        cell_id = region.label
-        centroid_y, centroid_x = region.centroid
+    for cell_id, centroid_y, centroid_x in zip(
+        props['label'], props['centroid-0'], props['centroid-1']
+    ):
         ax.text(centroid_x, centroid_y, str(cell_id), 
                 fontsize=8, ha='center', va='center', 
-                color='white', weight='bold',
-                bbox=dict(facecolor='black', alpha=0.5, pad=1))
+                color='white', weight='bold')
     
     ax.set_title('Cells with ID Labels')
     
@@ -105,8 +164,123 @@ def visualize_results(intensity_image, lifetime_image, binary_mask, cell_labels,
     return output_dir
 
 
+# Figure reused for every frame rendered by this process, keyed by image shape
+_frame_figures = {}
+
+
+def _frame_figure(image_shape):
+    """
+    Get this process's time series figure for images of the given shape.
+    
+    Creating the figure, axes and image artists once per process and only
+    swapping their data on later frames skips the figure setup per frame.
+    
+    Args:
+        image_shape (tuple): (Y, X) shape of the frames
+        
+    Returns:
+        tuple: (fig, axes, images) with one image artist per axis
+    """
+    if image_shape not in _frame_figures:
+        fig, axes = plt.subplots(1, 3, figsize=(15, 5))
+        blank = np.zeros(image_shape)
+        images = (
+            axes[0].imshow(blank, cmap='gray'),
+            axes[1].imshow(blank, cmap='viridis'),
+            axes[2].imshow(np.zeros((*image_shape, 3), dtype=np.uint8)),
+        )
+        
+        # Lay out once, with titles of the width used for every frame
+        for ax, title in zip(axes, ('Intensity', 'Lifetime', 'Tracked Cells')):
+            ax.set_title(f'{title} (t=0)')
+        fig.tight_layout()
+        
+        _frame_figures[image_shape] = (fig, axes, images)
+    return _frame_figures[image_shape]
+
+
+def _close_frame_figures():
+    """Close the figures reused by _render_frame in this process."""
+    for fig, _, _ in _frame_figures.values():
+        plt.close(fig)
+    _frame_figures.clear()
+
+
+def _render_frame(frame):
+    """
+    Render and save the visualization of one time point (process pool worker).
+    
+    Args:
+        frame (tuple): (t, intensity_image, lifetime_image, labeled_cells,
+                        tracks, cell_colors, vis_dir), where tracks are the
+                        (orig_id, cell_id) pairs present at time point t and
+                        cell_colors is a uint8 RGB color per tracked cell
+        
+    Returns:
+        str: Path to the saved figure
+    """
+    t, intensity_image, lifetime_image, labeled_cells, tracks, cell_colors, vis_dir = frame
+    
+    # Reuse the figure set up for frames of this shape
+    fig, axes, images = _frame_figure(labeled_cells.shape)
+    
+    # Plot intensity image
+    images[0].set_data(intensity_image)
+    images[0].set_clim(intensity_image.min(), intensity_image.max())
+    axes[0].set_title(f'Intensity (t={t})')
+    
+    # Plot lifetime image
+    images[1].set_data(lifetime_image)
+    images[1].set_clim(lifetime_image.min(), lifetime_image.max())
+    axes[1].set_title(f'Lifetime (t={t})')
+    
+    # Plot labeled cells with tracking colors
+    # Assign colors to cells based on tracking data in a label lookup table
+    color_lut = np.zeros((int(labeled_cells.max()) + 1, 3), dtype=np.uint8)
+    for orig_id, current_id in tracks:
+        color_idx = orig_id % len(cell_colors)  # Use modulo to avoid index errors
+        color_lut[current_id] = cell_colors[color_idx]
+    
+    # Create a colored image for tracked cells with a single gather
+    colored_labels = color_lut[labeled_cells]
+    
+    # Map each cell ID to its original (tracked) cell ID, keeping the
+    # first track if several share a cell
+    orig_ids = {}
+    for orig_id, current_id in tracks:
+        orig_ids.setdefault(current_id, orig_id)
+    
+    images[2].set_data(colored_labels)
+    axes[2].set_title(f'Tracked Cells (t={t})')
+    
+    # Clear the previous frame's cell IDs, then add this frame's
+    for text in list(axes[2].texts):
+        text.remove()
+    
+    from skimage import measure
+    regions = measure.regionprops(labeled_cells)
+    
+    for region in regions:
+        cell_id = region.label
+        centroid_y, centroid_x = region.centroid
+        # Find original cell ID for this cell
+        orig_id = orig_ids.get(cell_id)
+        
+        if orig_id is not None:
+            axes[2].text(centroid_x, centroid_y, str(orig_id), 
+                       fontsize=8, ha='center', va='center', 
+                       color='white', weight='bold')
+    
+    # Save the figure
+    output_path = os.path.join(vis_dir, f'time_point_{t:03d}.png')
+    fig.savefig(output_path, dpi=150)
+    
+    return output_path
+
+
 def visualize_time_series(intensity_time_series, lifetime_time_series, 
-                         labeled_cells_time_series, tracking_data, output_dir='.'):
+                         labeled_cells_time_series, tracking_data, output_dir='.',
+                         jobs=None):
     """
     Visualize time series analysis results.
     
@@ -116,6 +290,7 @@ def visualize_time_series(intensity_time_series, lifetime_time_series,
         labeled_cells_time_series (list): List of labeled cell images for each time point
         tracking_data (dict): Cell tracking data
         output_dir (str): Directory where visualizations will be saved
+        jobs (int): Number of worker processes (1 = serial, default: number of CPUs)
         
     Returns:
         str: Path to the output directory
@@ -129,66 +304,29 @@ def visualize_time_series(intensity_time_series, lifetime_time_series,
     
     # Create a unique color for each tracked cell
     n_cells = len(tracking_data)
-    np.random.seed(42)  # for reproducibility
-    cell_colors = np.random.rand(n_cells + 1, 3)
-    cell_colors[0] = [0, 0, 0]  # background is black
+    cell_colors = (_cell_colors(n_cells) * 255).astype(np.uint8)
     
-    # For each time point, create a visualization
-    for t in range(time_points):
-        # Set up figure for multiple plots
-        fig, axes = plt.subplots(1, 3, figsize=(15, 5))
-        
-        # Plot intensity image
-        axes[0].imshow(intensity_time_series[t], cmap='gray')
-        axes[0].set_title(f'Intensity (t={t})')
-        
-        # Plot lifetime image
-        axes[1].imshow(lifetime_time_series[t], cmap='viridis')
-        axes[1].set_title(f'Lifetime (t={t})')
-        
-        # Plot labeled cells with tracking colors
-        labeled_cells = labeled_cells_time_series[t]
-        
-        # Create a colored image for tracked cells
-        colored_labels = np.zeros((*labeled_cells.shape, 3))
-        
-        # Assign colors to cells based on tracking data
-        for orig_id, track_info in tracking_data.items():
-            if t in track_info:
-                current_id = track_info[t][0]
-                cell_mask = (labeled_cells == current_id)
-                color_idx = orig_id % len(cell_colors)  # Use modulo to avoid index errors
-                colored_labels[cell_mask] = cell_colors[color_idx]
-        
-        axes[2].imshow(colored_labels)
-        axes[2].set_title(f'Tracked Cells (t={t})')
-        
-        # Add cell IDs
-        from skimage import measure
-        regions = measure.regionprops(labeled_cells)
-        
-        for region in regions:
-            cell_id = region.label
-            centroid_y, centroid_x = region.centroid
-            # Find original cell ID for this cell
-            orig_id = None
-            for tracking_id, track_info in tracking_data.items():
-                if t in track_info and track_info[t][0] == cell_id:
-                    orig_id = tracking_id
-                    break
-            
-            if orig_id is not None:
-                axes[2].text(centroid_x, centroid_y, str(orig_id), 
-                           fontsize=8, ha='center', va='center', 
-                           color='white', weight='bold')
-        
-        # Adjust layout and save figure
-        plt.tight_layout()
-        
-        # Save the figure
-        output_path = os.path.join(vis_dir, f'time_point_{t:03d}.png')
-        plt.savefig(output_path, dpi=150)
-        plt.close(fig)
+    # Tracks present at each time point
+    frame_tracks = tracks_by_time_point(tracking_data, time_points)
+    
+    # Frames are independent, so render them in parallel unless running serially
+    frames = (
+        (t, intensity_time_series[t], lifetime_time_series[t],
+         labeled_cells_time_series[t], frame_tracks[t], cell_colors, vis_dir)
+        for t in range(time_points)
+    )
+    if jobs is not None and jobs <= 1:
+        for frame in frames:
+            _render_frame(frame)
+        _close_frame_figures()
+    else:
+        # Callers may have export threads running, and forking a process with
+        # live threads can deadlock, so start workers from a clean server process
+        start_method = ('forkserver' if 'forkserver' in multiprocessing.get_all_start_methods()
+                        else 'spawn')
+        with ProcessPoolExecutor(max_workers=jobs,
+                                 mp_context=multiprocessing.get_context(start_method)) as executor:
+            list(executor.map(_render_frame, frames, chunksize=4))
     
     print(f"Saved time series visualizations to: {vis_dir}")
     return vis_dir
\ No newline at end of file